@@ -0,0 +1,29 @@
+"""
+Event loop helper for the OpenRouter probe and the agent tests.
+
+Kept free of SDK and LiteLLM imports so scripts can use it without loading
+the agent stack.
+"""
+
+import asyncio
+import sys
+
+try:
+    if sys.platform == "win32":
+        import winloop as uvloop
+    else:
+        import uvloop
+except ImportError:  # faster event loop is optional
+    uvloop = None
+
+
+def run_async(coro):
+    """
+    Run a coroutine to completion, on uvloop (or winloop) when installed.
+    
+    The faster loop only pays off for coroutines doing their own socket I/O,
+    such as concurrent LiteLLM acompletion calls.
+    """
+    if uvloop is not None:
+        return uvloop.run(coro)
+    return asyncio.run(coro)
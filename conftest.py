@@ -0,0 +1,25 @@
+"""
+Pytest configuration shared by the test suite.
+
+Integration tests declare their expected LLM cost with
+``@pytest.mark.llm_cost("short" | "long")``. Collection is reordered so long
+tests start first (longest-processing-time-first), which keeps slow agent
+runs from straggling at the end of a parallel (pytest-xdist) session.
+"""
+
+# Scheduling rank per cost; unmarked tests are fast unit tests and run last
+LLM_COST_RANK = {"long": 0, "short": 1}
+UNMARKED_RANK = len(LLM_COST_RANK)
+
+
+def llm_cost_rank(item) -> int:
+    """Scheduling rank of a collected test from its llm_cost marker."""
+    marker = item.get_closest_marker("llm_cost")
+    if marker is None or not marker.args:
+        return UNMARKED_RANK
+    return LLM_COST_RANK.get(marker.args[0], UNMARKED_RANK)
+
+
+def pytest_collection_modifyitems(config, items):
+    """Run the most expensive tests first; ties keep collection order."""
+    items.sort(key=llm_cost_rank)
@@ -14,10 +14,16 @@ Model Info:
     - Architecture: MoE (117B params, 5.1B activated)
 """
 
+import logging
+
 from openhands_agent import run_gpt_oss_agent
 
 
 def main():
+    # Show the agent's progress without turning on INFO logs of every library
+    progress = logging.getLogger("openhands_agent")
+    progress.addHandler(logging.StreamHandler())
+    progress.setLevel(logging.INFO)
     task = "List the files in the current directory and write a summary to SUMMARY.txt"
     run_gpt_oss_agent(task)
 
@@ -15,10 +15,16 @@ LiteLLM Integration:
     - Docs: https://docs.litellm.ai/docs/providers/openrouter
 """
 
+import logging
+
 from openhands_agent import run_qwen_agent
 
 
 def main():
+    # Show the agent's progress without turning on INFO logs of every library
+    progress = logging.getLogger("openhands_agent")
+    progress.addHandler(logging.StreamHandler())
+    progress.setLevel(logging.INFO)
     task = "List the files in the current directory and write a summary to SUMMARY.txt"
     run_qwen_agent(task)
 
@@ -9,16 +9,34 @@ Supported Models:
     - Qwen3 Coder: openrouter/qwen/qwen3-coder (default, high quality)
 """
 
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import json
+import logging
 import os
+import re
+import shutil
+import sqlite3
+import threading
+import uuid
+from array import array
+from collections.abc import Mapping
+from contextlib import closing
 from dataclasses import dataclass
-from typing import Callable
+from functools import lru_cache
+from typing import Callable, Final
 
+import litellm
 from dotenv import load_dotenv
 
 from openhands.sdk import LLM, Agent, Conversation, Tool
-from openhands.tools.file_editor import FileEditorTool
-from openhands.tools.task_tracker import TaskTrackerTool
-from openhands.tools.terminal import TerminalTool
+from openhands.sdk.conversation.state import ConversationExecutionStatus
+from openhands.sdk.tool import register_tool
+
+
+log = logging.getLogger(__name__)
 
 
 # Model configurations
@@ -32,7 +50,7 @@ class ModelConfig:
 
 
 # Pre-configured models
-MODELS = {
+MODELS: Final[Mapping[str, ModelConfig]] = {
     "gpt-oss": ModelConfig(
         name="GPT-OSS-120B",
         model_id="openrouter/openai/gpt-oss-120b",
@@ -48,9 +66,260 @@ MODELS = {
 }
 
 
+# Read .env once at import rather than on every agent invocation
+if not os.getenv("OPENROUTER_API_KEY"):
+    load_dotenv()
+
+
+# Local completion cache: agent loops replay identical prefixes, so identical
+# requests are served from LiteLLM's on-disk cache. Set LLM_CACHE=0 to disable.
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+RESPONSE_CACHE_DIR = os.path.join(LLM_CACHE_DIR, "responses")
+
+
+def llm_cache_enabled() -> bool:
+    """Whether completions should be served from the local response cache."""
+    return os.getenv("LLM_CACHE", "1") != "0"
+
+
+@lru_cache(maxsize=1)
+def enable_response_cache() -> None:
+    """Install LiteLLM's disk cache for all completions (first call only)."""
+    litellm.cache = litellm.Cache(type="disk", disk_cache_dir=RESPONSE_CACHE_DIR)
+
+
+# Semantic task cache (opt-in): a task paraphrasing one already run with the
+# same LLM configuration in the same workspace returns the persisted
+# conversation without calling the LLM or running any tools, so file changes
+# the original run made are not re-applied. Needs sentence-transformers; set
+# SEMANTIC_CACHE=1 to enable. Only the newest SEMANTIC_CACHE_MAX_ENTRIES
+# conversations are kept.
+SEMANTIC_CACHE_DB = os.path.join(LLM_CACHE_DIR, "semantic.sqlite")
+CONVERSATIONS_DIR = os.path.join(LLM_CACHE_DIR, "conversations")
+SEMANTIC_CACHE_MAX_ENTRIES = 256
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.80
+
+
+def semantic_cache_enabled() -> bool:
+    """Whether run_agent may answer from the semantic task cache."""
+    if os.getenv("SEMANTIC_CACHE", "0") != "1":
+        return False
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+
+@lru_cache(maxsize=1)
+def get_embedding_model():
+    """Load the local sentence embedding model (first use only)."""
+    # Imported here: sentence-transformers pulls in torch, which would slow
+    # down every import of this module
+    from sentence_transformers import SentenceTransformer
+    
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+def embed_task(task: str) -> array:
+    """Embed a task as a unit-length float32 vector."""
+    vector = get_embedding_model().encode(task, normalize_embeddings=True)
+    return array("f", vector)
+
+
+def llm_config_key(llm: LLM) -> str:
+    """
+    Hash an LLM's configuration (minus credentials).
+    
+    A persisted conversation can only be reopened with an LLM whose
+    configuration matches the one it was run with.
+    """
+    config = json.dumps(llm.model_dump(mode="json", exclude={"api_key"}), sort_keys=True)
+    return hashlib.blake2b(config.encode(), digest_size=16).hexdigest()
+
+
+def _semantic_cache_db() -> sqlite3.Connection:
+    """Open the semantic cache database, creating its table if needed."""
+    os.makedirs(os.path.dirname(SEMANTIC_CACHE_DB), exist_ok=True)
+    db = sqlite3.connect(SEMANTIC_CACHE_DB)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS cached_tasks ("
+        "llm_config TEXT, workspace TEXT, embedding BLOB, conversation_id TEXT)"
+    )
+    return db
+
+
+def _conversation_dir(conversation_id: str) -> str:
+    """Directory the SDK persists a conversation in under CONVERSATIONS_DIR."""
+    return os.path.join(CONVERSATIONS_DIR, uuid.UUID(conversation_id).hex)
+
+
+def lookup_cached_task(llm_config: str, workspace: str, query: array) -> uuid.UUID | None:
+    """
+    Return the id of the closest cached conversation above the similarity threshold.
+    
+    Rows whose persisted conversation has been deleted can never be restored,
+    so they are dropped instead of matched.
+    """
+    with closing(_semantic_cache_db()) as db, db:
+        rows = db.execute(
+            "SELECT rowid, embedding, conversation_id FROM cached_tasks"
+            " WHERE llm_config = ? AND workspace = ?",
+            (llm_config, workspace),
+        ).fetchall()
+        live = []
+        for rowid, blob, conversation_id in rows:
+            if os.path.isdir(_conversation_dir(conversation_id)):
+                live.append((blob, conversation_id))
+            else:
+                db.execute("DELETE FROM cached_tasks WHERE rowid = ?", (rowid,))
+    
+    best_id, best_score = None, SEMANTIC_CACHE_THRESHOLD
+    for blob, conversation_id in live:
+        embedding = array("f")
+        embedding.frombytes(blob)
+        score = sum(a * b for a, b in zip(query, embedding))
+        if score >= best_score:
+            best_id, best_score = conversation_id, score
+    return uuid.UUID(best_id) if best_id else None
+
+
+def store_cached_task(
+    llm_config: str, workspace: str, embedding: array, conversation_id: uuid.UUID
+) -> None:
+    """Record a completed conversation, evicting the oldest beyond SEMANTIC_CACHE_MAX_ENTRIES."""
+    with closing(_semantic_cache_db()) as db, db:
+        db.execute(
+            "INSERT INTO cached_tasks VALUES (?, ?, ?, ?)",
+            (llm_config, workspace, embedding.tobytes(), str(conversation_id)),
+        )
+        evicted = db.execute(
+            "SELECT rowid, conversation_id FROM cached_tasks"
+            " ORDER BY rowid DESC LIMIT -1 OFFSET ?",
+            (SEMANTIC_CACHE_MAX_ENTRIES,),
+        ).fetchall()
+        db.executemany("DELETE FROM cached_tasks WHERE rowid = ?", [(rowid,) for rowid, _ in evicted])
+    for _, evicted_id in evicted:
+        shutil.rmtree(_conversation_dir(evicted_id), ignore_errors=True)
+
+
+def restore_conversation(llm: LLM, workspace: str, conversation_id: uuid.UUID) -> Conversation:
+    """Reopen a conversation persisted in CONVERSATIONS_DIR without running it."""
+    return Conversation(
+        agent=create_agent(llm),
+        workspace=workspace,
+        persistence_dir=CONVERSATIONS_DIR,
+        conversation_id=conversation_id,
+    )
+
+
+# Phrases in a draft reply that signal the cheap model is out of its depth
+UNCERTAIN_PHRASES = ("i'm not sure", "i am not sure")
+
+# Tool results that mean the previous call failed: a failed observation starts
+# with the SDK's ERROR_MESSAGE_HEADER, and the AgentErrorEvent texts for a bad
+# tool call start "Tool 'x' not found" or "Error validating args". Only these
+# exact formats count, so tool output such as a listing of error.log does not.
+TOOL_ERROR_HEADER = "[An error occurred during execution.]"
+AGENT_ERROR_PATTERN = re.compile(r"Tool '[^']*' not found|Error validating args ")
+
+# Draft errors the escalation model would hit too: it shares the API key and
+# provider. The SDK may re-raise LiteLLM errors as its own, chaining the original.
+DRAFT_FATAL_ERRORS = (
+    litellm.AuthenticationError,
+    litellm.PermissionDeniedError,
+    litellm.NotFoundError,
+)
+
+# Output cap for draft turns: GPT-OSS spends reasoning tokens before a tool
+# call, so a tighter cap truncates (and escalates) most drafts
+CASCADE_DRAFT_MAX_OUTPUT_TOKENS = 1024
+
+
+def _message_text(message) -> str:
+    """Concatenate the text parts of an SDK message."""
+    return "".join(getattr(part, "text", "") for part in message.content or [])
+
+
+def _previous_tool_failed(messages: list) -> bool:
+    """Whether the last message is an error result from a tool call."""
+    if not messages or messages[-1].role != "tool":
+        return False
+    text = _message_text(messages[-1]).lstrip()
+    return text.startswith(TOOL_ERROR_HEADER) or AGENT_ERROR_PATTERN.match(text) is not None
+
+
+def _draft_error_fatal(error: Exception) -> bool:
+    """Whether a draft error is a configuration or auth failure rather than a bad turn."""
+    return isinstance(error, DRAFT_FATAL_ERRORS) or isinstance(error.__cause__, DRAFT_FATAL_ERRORS)
+
+
+def _tool_call_invalid(tool_call, tool_names: set[str] | None) -> bool:
+    """Whether a tool call names an unknown tool or has non-object arguments."""
+    if tool_names is not None and tool_call.name not in tool_names:
+        return True
+    try:
+        arguments = json.loads(tool_call.arguments or "{}")
+    except (TypeError, ValueError):
+        return True
+    return not isinstance(arguments, dict)
+
+
+def _draft_rejected(response, tools=None) -> bool:
+    """Whether a draft completion is empty, uncertain, malformed or truncated."""
+    message = response.message
+    text = _message_text(message).lower()
+    if not message.tool_calls and not text.strip():
+        return True
+    if any(phrase in text for phrase in UNCERTAIN_PHRASES):
+        return True
+    tool_names = {tool.name for tool in tools} if tools is not None else None
+    if any(_tool_call_invalid(call, tool_names) for call in message.tool_calls or []):
+        return True
+    
+    choices = getattr(response.raw_response, "choices", None) or []
+    return bool(choices) and choices[0].finish_reason == "length"
+
+
+class CascadeLLM(LLM):
+    """
+    LLM that drafts each turn with a cheap model and escalates hard turns.
+    
+    Every completion goes to draft_llm first; it is re-issued to
+    escalation_llm if the draft errors, is empty, truncated or uncertain,
+    calls a tool that was not offered or with arguments that are not a JSON
+    object, or if the previous tool call failed. Auth and model configuration
+    errors from the draft are raised rather than escalated.
+    """
+
+    draft_llm: LLM
+    escalation_llm: LLM
+    # Exponential moving average of draft turns accepted without escalation
+    _acceptance_rate: float = 1.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        """Moving-average fraction of turns served by the draft model."""
+        return self._acceptance_rate
+
+    def completion(self, messages, tools=None, **kwargs):
+        response = None
+        # After a failed tool call, go straight to the stronger model
+        if not _previous_tool_failed(messages):
+            try:
+                response = self.draft_llm.completion(messages, tools=tools, **kwargs)
+            except Exception as error:
+                if _draft_error_fatal(error):
+                    raise
+                log.warning("Draft model failed; escalating this turn", exc_info=True)
+        
+        accepted = response is not None and not _draft_rejected(response, tools)
+        self._acceptance_rate = 0.9 * self._acceptance_rate + 0.1 * accepted
+        if accepted:
+            return response
+        return self.escalation_llm.completion(messages, tools=tools, **kwargs)
+
+
+@lru_cache(maxsize=1)
 def get_api_key() -> str:
     """Get OpenRouter API key from environment."""
-    load_dotenv()
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
         raise ValueError(
@@ -60,32 +329,106 @@ def get_api_key() -> str:
     return api_key
 
 
-def create_llm(model_config: ModelConfig, api_key: str) -> LLM:
-    """Create an LLM instance with the given configuration."""
+def create_llm(
+    model_config: ModelConfig,
+    api_key: str,
+    max_output_tokens: int | None = None,
+    stream: bool = False,
+    usage_id: str = "default",
+) -> LLM:
+    """
+    Create an LLM instance with the given configuration.
+    
+    max_output_tokens overrides the model's default cap for this LLM;
+    stream requests token-by-token responses from the provider. usage_id
+    must be unique among the LLMs of one agent.
+    """
+    if llm_cache_enabled():
+        enable_response_cache()
     return LLM(
         model=model_config.model_id,
         api_key=api_key,
-        max_output_tokens=model_config.max_output_tokens,
+        max_output_tokens=max_output_tokens or model_config.max_output_tokens,
+        stream=stream,
+        usage_id=usage_id,
+    )
+
+
+def create_cascade_llm(api_key: str) -> CascadeLLM:
+    """Create a CascadeLLM drafting with GPT-OSS and escalating to Qwen3 Coder."""
+    draft_config = MODELS["gpt-oss"]
+    return CascadeLLM(
+        model=draft_config.model_id,
+        api_key=api_key,
+        max_output_tokens=CASCADE_DRAFT_MAX_OUTPUT_TOKENS,
+        usage_id="cascade",
+        draft_llm=create_llm(
+            draft_config,
+            api_key,
+            CASCADE_DRAFT_MAX_OUTPUT_TOKENS,
+            usage_id="cascade-draft",
+        ),
+        escalation_llm=create_llm(MODELS["qwen"], api_key, usage_id="cascade-escalation"),
     )
 
 
+# Standard coding tools. Their implementations are only imported when a
+# conversation first resolves them, keeping CLI startup fast. The lazy
+# factories get their own registry keys: each tool module registers its
+# canonical name when imported, which would otherwise be a duplicate.
+TERMINAL_TOOL = "terminal"
+FILE_EDITOR_TOOL = "file_editor"
+TASK_TRACKER_TOOL = "task_tracker"
+
+_LAZY_TOOLS = {
+    f"lazy_{TERMINAL_TOOL}": ("openhands.tools.terminal", "TerminalTool"),
+    f"lazy_{FILE_EDITOR_TOOL}": ("openhands.tools.file_editor", "FileEditorTool"),
+    f"lazy_{TASK_TRACKER_TOOL}": ("openhands.tools.task_tracker", "TaskTrackerTool"),
+}
+
+
+# The SDK resolves an agent's tools on a thread pool, so concurrent first-use
+# imports of the tool modules race; all of them are loaded together, once.
+_tool_import_lock = threading.Lock()
+_tool_classes: dict[str, type] = {}
+
+
+def _import_tool_classes() -> dict[str, type]:
+    """Import every lazy tool module under one lock, before any tool is created."""
+    with _tool_import_lock:
+        if not _tool_classes:
+            # Publish only a complete set, so a failed import is retried next time
+            _tool_classes.update({
+                key: getattr(importlib.import_module(module_name), class_name)
+                for key, (module_name, class_name) in _LAZY_TOOLS.items()
+            })
+    return _tool_classes
+
+
+def _lazy_tool_factory(key: str) -> Callable:
+    """Build a tool factory that imports the tool implementations on first use."""
+    def factory(conv_state, **params):
+        return _import_tool_classes()[key].create(conv_state, **params)
+    return factory
+
+
+for _key in _LAZY_TOOLS:
+    register_tool(_key, _lazy_tool_factory(_key))
+
+
 def create_agent(llm: LLM) -> Agent:
     """Create an agent with standard coding tools."""
-    return Agent(
-        llm=llm,
-        tools=[
-            Tool(name=TerminalTool.name),
-            Tool(name=FileEditorTool.name),
-            Tool(name=TaskTrackerTool.name),
-        ],
-    )
+    return Agent(llm=llm, tools=[Tool(name=name) for name in _LAZY_TOOLS])
 
 
 def run_agent(
     model_key: str,
     task: str,
     workspace: str | None = None,
-    verbose: bool = True,
+    *,
+    max_output_tokens: int | None = None,
+    stream: bool = False,
+    token_callbacks: list[Callable] | None = None,
 ) -> Conversation:
     """
     Run an OpenHands agent with the specified model and task.
@@ -94,42 +437,203 @@ def run_agent(
         model_key: Key for the model configuration ("gpt-oss" or "qwen")
         task: The task description to send to the agent
         workspace: Working directory (defaults to current directory)
-        verbose: Whether to print progress messages
+        max_output_tokens: Per-turn output token cap (defaults to the model's cap)
+        stream: Whether to stream completions token by token
+        token_callbacks: Callbacks for streamed completion chunks (ignored by default)
         
     Returns:
         The completed Conversation object
     """
-    if model_key not in MODELS:
-        raise ValueError(f"Unknown model: {model_key}. Available: {list(MODELS.keys())}")
+    model_config = MODELS.get(model_key)
+    if model_config is None:
+        raise ValueError(f"Unknown model: {model_key}. Available: {list(MODELS)}")
     
-    model_config = MODELS[model_key]
     api_key = get_api_key()
     
-    llm = create_llm(model_config, api_key)
+    llm = create_llm(model_config, api_key, max_output_tokens, stream)
+    model_label = f"{model_config.name} ({model_config.model_id})"
+    
+    if not semantic_cache_enabled():
+        return run_conversation(
+            llm, task, workspace, model_label=model_label, token_callbacks=token_callbacks
+        )
+    
+    workspace = os.path.abspath(workspace or _default_workspace())
+    llm_config = llm_config_key(llm)
+    embedding = embed_task(task)
+    conversation_id = lookup_cached_task(llm_config, workspace, embedding)
+    if conversation_id is not None:
+        log.info("Reusing cached conversation for similar task: %s", task)
+        return restore_conversation(llm, workspace, conversation_id)
+    
+    conversation = run_conversation(
+        llm,
+        task,
+        workspace,
+        model_label=model_label,
+        persistence_dir=CONVERSATIONS_DIR,
+        token_callbacks=token_callbacks,
+    )
+    # Errored, stuck or paused runs would otherwise be replayed for every paraphrase
+    if conversation.state.execution_status == ConversationExecutionStatus.FINISHED:
+        store_cached_task(llm_config, workspace, embedding, conversation.id)
+    else:
+        shutil.rmtree(_conversation_dir(str(conversation.id)), ignore_errors=True)
+    return conversation
+
+
+def run_cascade_agent(
+    task: str,
+    workspace: str | None = None,
+) -> Conversation:
+    """
+    Run an agent that drafts turns with GPT-OSS and escalates hard ones to Qwen.
+    
+    Args:
+        task: The task description to send to the agent
+        workspace: Working directory (defaults to current directory)
+        
+    Returns:
+        The completed Conversation object
+    """
+    llm = create_cascade_llm(get_api_key())
+    model_label = f"{MODELS['gpt-oss'].name} -> {MODELS['qwen'].name} cascade"
+    conversation = run_conversation(llm, task, workspace, model_label=model_label)
+    log.info("Draft acceptance rate: %.0f%%", 100 * llm.acceptance_rate)
+    
+    return conversation
+
+
+@lru_cache(maxsize=1)
+def _default_workspace() -> str:
+    """
+    Current directory at first use, the default agent workspace.
+    
+    Call _default_workspace.cache_clear() after os.chdir to pick up the new directory.
+    """
+    return os.getcwd()
+
+
+def _ignore_token(chunk) -> None:
+    """Discard a streamed completion chunk."""
+
+
+def run_conversation(
+    llm: LLM,
+    task: str,
+    workspace: str | None = None,
+    *,
+    model_label: str | None = None,
+    persistence_dir: str | None = None,
+    token_callbacks: list[Callable] | None = None,
+) -> Conversation:
+    """
+    Run a task to completion with an agent built on an existing LLM.
+    
+    Reusing one LLM across runs skips per-run LLM setup.
+    
+    Args:
+        llm: The LLM to drive the agent
+        task: The task description to send to the agent
+        workspace: Working directory (defaults to current directory)
+        model_label: Model description for log messages (defaults to llm.model)
+        persistence_dir: Directory to persist the conversation in (not persisted by default)
+        token_callbacks: Callbacks for streamed completion chunks (ignored by default)
+        
+    Returns:
+        The completed Conversation object
+    """
+    model_label = model_label or llm.model
     agent = create_agent(llm)
     
-    workspace = workspace or os.getcwd()
-    conversation = Conversation(agent=agent, workspace=workspace)
+    workspace = workspace or _default_workspace()
+    # The SDK needs a consumer for streamed tokens even when the caller has none
+    conversation = Conversation(
+        agent=agent,
+        workspace=workspace,
+        persistence_dir=persistence_dir,
+        token_callbacks=token_callbacks or [_ignore_token],
+    )
     
-    if verbose:
-        print(f"🚀 Sending task to agent: {task}")
-        print(f"📡 Using model: {model_config.name} ({model_config.model_id})")
+    log.info("Sending task to agent: %s", task)
+    log.info("Using model: %s", model_label)
     
     conversation.send_message(task)
+    # Turns stay serial: each LLM request needs the previous tool results, and
+    # the SDK executes a response's tool calls only after it is complete.
     conversation.run()
     
-    if verbose:
-        print("✅ All done!")
+    log.info("Agent finished")
     
     return conversation
 
 
-def run_gpt_oss_agent(task: str, workspace: str | None = None, verbose: bool = True) -> Conversation:
+async def run_agent_async(
+    model_key: str,
+    task: str,
+    workspace: str | None = None,
+    *,
+    max_output_tokens: int | None = None,
+    stream: bool = False,
+    token_callbacks: list[Callable] | None = None,
+) -> Conversation:
+    """
+    Async variant of run_agent.
+    
+    The SDK conversation loop is synchronous, so it runs in a worker thread
+    and the event loop stays free to drive other agents. Concurrency is
+    bounded by the default thread pool executor.
+    """
+    return await asyncio.to_thread(
+        run_agent,
+        model_key,
+        task,
+        workspace,
+        max_output_tokens=max_output_tokens,
+        stream=stream,
+        token_callbacks=token_callbacks,
+    )
+
+
+async def run_many(
+    tasks: list[tuple[str, str]],
+    workspace: str | None = None,
+) -> list[Conversation]:
+    """
+    Run several agents concurrently.
+    
+    Each agent runs in a worker thread (see run_agent_async), so the event
+    loop only awaits thread futures and a faster loop such as uvloop does
+    not change throughput here.
+    
+    Args:
+        tasks: (model_key, task) pairs to run
+        workspace: Working directory shared by all agents (defaults to current directory)
+        
+    Returns:
+        The completed Conversation objects, in the same order as tasks
+    """
+    return await asyncio.gather(
+        *(run_agent_async(model_key, task, workspace) for model_key, task in tasks)
+    )
+
+
+def run_gpt_oss_agent(
+    task: str,
+    workspace: str | None = None,
+    *,
+    max_output_tokens: int | None = None,
+) -> Conversation:
     """Run an agent with GPT-OSS-120B model."""
-    return run_agent("gpt-oss", task, workspace, verbose)
+    return run_agent("gpt-oss", task, workspace, max_output_tokens=max_output_tokens)
 
 
-def run_qwen_agent(task: str, workspace: str | None = None, verbose: bool = True) -> Conversation:
+def run_qwen_agent(
+    task: str,
+    workspace: str | None = None,
+    *,
+    max_output_tokens: int | None = None,
+) -> Conversation:
     """Run an agent with Qwen3 Coder model."""
-    return run_agent("qwen", task, workspace, verbose)
+    return run_agent("qwen", task, workspace, max_output_tokens=max_output_tokens)
 
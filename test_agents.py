@@ -18,22 +18,68 @@ Usage:
 """
 
 import os
+import sqlite3
+import sys
 import tempfile
+import threading
+import time
+import uuid
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
+from types import SimpleNamespace
 
+import litellm
 import pytest
 
+from openhands.sdk import LLM, Conversation, Message, TextContent
+from openhands.sdk.event import AgentErrorEvent, ObservationEvent
+from openhands.sdk.tool import Observation
+
+from async_runtime import run_async
 from openhands_agent import (
+    _LAZY_TOOLS,
     MODELS,
+    CascadeLLM,
+    _lazy_tool_factory,
+    _message_text,
     create_agent,
+    create_cascade_llm,
     create_llm,
+    enable_response_cache,
     get_api_key,
+    llm_config_key,
+    lookup_cached_task,
+    restore_conversation,
+    run_cascade_agent,
+    run_conversation,
     run_gpt_oss_agent,
+    run_many,
     run_qwen_agent,
+    store_cached_task,
 )
 
 
-@pytest.fixture
+# Single-file tasks need only short tool-call turns; leave headroom for reasoning tokens
+FILE_TASK_MAX_OUTPUT_TOKENS = 1024
+
+
+@pytest.fixture(scope="session", autouse=True)
+def no_llm_caches():
+    """
+    Turn off the response and semantic caches for the whole session.
+    
+    Tests must exercise the model, not replay earlier completions or similar
+    tasks, and must not write cache files into the checkout.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("LLM_CACHE", "0")
+        mp.setenv("SEMANTIC_CACHE", "0")
+        yield
+
+
+@pytest.fixture(scope="session")
 def api_key():
     """Get API key, skip test if not available."""
     try:
@@ -42,6 +88,18 @@ def api_key():
         pytest.skip("OPENROUTER_API_KEY not set")
 
 
+@pytest.fixture(scope="session")
+def gpt_oss_llm(api_key):
+    """GPT-OSS LLM shared by TestAgentCreation and TestBothModels."""
+    return create_llm(MODELS["gpt-oss"], api_key)
+
+
+@pytest.fixture(scope="session")
+def qwen_llm(api_key):
+    """Qwen LLM shared by TestBothModels."""
+    return create_llm(MODELS["qwen"], api_key)
+
+
 @pytest.fixture
 def temp_workspace():
     """Create a temporary workspace directory for testing."""
@@ -72,21 +130,333 @@ class TestModelConfiguration:
         llm = create_llm(config, api_key)
         assert llm is not None
     
+    def test_create_llm_max_output_tokens_override(self, api_key):
+        """Test a per-call output token cap overrides the model default."""
+        config = MODELS["gpt-oss"]
+        assert create_llm(config, api_key).max_output_tokens == config.max_output_tokens
+        assert create_llm(config, api_key, max_output_tokens=256).max_output_tokens == 256
+    
+    @pytest.mark.parametrize("runner", [run_gpt_oss_agent, run_qwen_agent])
+    def test_runner_options_are_keyword_only(self, runner):
+        """A stale positional verbose flag is rejected, not taken as a token cap."""
+        with pytest.raises(TypeError):
+            runner("task", ".", True)
+    
     def test_create_llm_qwen(self, api_key):
         """Test LLM creation with Qwen config."""
         config = MODELS["qwen"]
         llm = create_llm(config, api_key)
         assert llm is not None
+    
+    def test_create_cascade_llm(self, api_key):
+        """Test cascade LLM drafts with GPT-OSS and escalates to Qwen."""
+        llm = create_cascade_llm(api_key)
+        assert llm.draft_llm.model == MODELS["gpt-oss"].model_id
+        assert llm.escalation_llm.model == MODELS["qwen"].model_id
+        assert llm.acceptance_rate == 1.0
+        # Each LLM must register under its own usage ID in the conversation
+        usage_ids = {llm.usage_id, llm.draft_llm.usage_id, llm.escalation_llm.usage_id}
+        assert len(usage_ids) == 3
+
+
+class StubLLM(LLM):
+    """LLM returning a canned reply (or raising it) without network access."""
+    
+    _reply: object = None
+    _calls: int = 0
+    
+    def completion(self, messages, tools=None, **kwargs):
+        self._calls += 1
+        if isinstance(self._reply, Exception):
+            raise self._reply
+        return self._reply
+
+
+def stub_llm(usage_id, reply):
+    """Build a StubLLM answering every completion with reply."""
+    llm = StubLLM(model="stub", usage_id=usage_id)
+    llm._reply = reply
+    return llm
+
+
+def stub_response(
+    text="",
+    tool_call=False,
+    finish_reason="stop",
+    tool_name="file_editor",
+    arguments='{"command": "view", "path": "a.txt"}',
+):
+    """Build a minimal completion response as seen by CascadeLLM."""
+    call = SimpleNamespace(id="call-1", name=tool_name, arguments=arguments)
+    message = SimpleNamespace(
+        role="assistant",
+        content=[SimpleNamespace(text=text)],
+        tool_calls=[call] if tool_call else None,
+    )
+    raw_response = SimpleNamespace(choices=[SimpleNamespace(finish_reason=finish_reason)])
+    return SimpleNamespace(message=message, raw_response=raw_response)
+
+
+def observation_message(text, is_error=False):
+    """Build the tool message the SDK sends for a terminal observation."""
+    return ObservationEvent(
+        observation=Observation.from_text(text=text, is_error=is_error),
+        action_id="action-1",
+        tool_name="terminal",
+        tool_call_id="call-1",
+    ).to_llm_message()
+
+
+def user_message(text):
+    """Build a minimal prompt message."""
+    return SimpleNamespace(role="user", content=[SimpleNamespace(text=text)])
+
+
+class TestCascadeRouting:
+    """Test CascadeLLM's draft acceptance and escalation decisions."""
+    
+    ESCALATED = stub_response(text="escalated", tool_call=True)
+    TOOLS = [SimpleNamespace(name="file_editor"), SimpleNamespace(name="terminal")]
+    
+    def cascade(self, draft_reply):
+        return CascadeLLM(
+            model="stub",
+            usage_id="cascade",
+            draft_llm=stub_llm("draft", draft_reply),
+            escalation_llm=stub_llm("escalation", self.ESCALATED),
+        )
+    
+    def test_accepts_draft_tool_call(self):
+        """A complete draft tool call is returned without escalation."""
+        draft = stub_response(tool_call=True)
+        llm = self.cascade(draft)
+        
+        assert llm.completion([user_message("create a file")], tools=self.TOOLS) is draft
+        assert llm.escalation_llm._calls == 0
+        assert llm.acceptance_rate == 1.0
+    
+    @pytest.mark.parametrize("draft", [
+        pytest.param(stub_response(), id="empty"),
+        pytest.param(stub_response(text="I'm not sure which file you mean"), id="uncertain"),
+        pytest.param(stub_response(tool_call=True, finish_reason="length"), id="truncated"),
+        pytest.param(stub_response(tool_call=True, tool_name="browser"), id="unknown_tool"),
+        pytest.param(stub_response(tool_call=True, arguments='{"path": "a.txt"'), id="invalid_json"),
+        pytest.param(stub_response(tool_call=True, arguments='["a.txt"]'), id="non_object_arguments"),
+        pytest.param(RuntimeError("provider error"), id="error"),
+    ])
+    def test_escalates_rejected_draft(self, draft):
+        """Empty, uncertain, truncated, malformed or failed drafts go to the escalation model."""
+        llm = self.cascade(draft)
+        
+        assert llm.completion([user_message("create a file")], tools=self.TOOLS) is self.ESCALATED
+        assert llm.draft_llm._calls == 1
+        assert llm.escalation_llm._calls == 1
+        assert llm.acceptance_rate == pytest.approx(0.9)
+    
+    def test_logs_draft_error(self, caplog):
+        """A failed draft is logged with its traceback before escalating."""
+        llm = self.cascade(RuntimeError("provider error"))
+        
+        with caplog.at_level("WARNING", logger="openhands_agent"):
+            assert llm.completion([user_message("create a file")], tools=self.TOOLS) is self.ESCALATED
+        assert any(record.exc_info for record in caplog.records)
+    
+    def test_raises_draft_auth_error(self):
+        """An auth error would fail the escalation model too, so it is raised."""
+        error = litellm.AuthenticationError("invalid key", llm_provider="openrouter", model="stub")
+        llm = self.cascade(error)
+        
+        with pytest.raises(litellm.AuthenticationError):
+            llm.completion([user_message("create a file")], tools=self.TOOLS)
+        assert llm.escalation_llm._calls == 0
+    
+    @pytest.mark.parametrize("make_tool_error", [
+        pytest.param(
+            lambda: observation_message("cat: a.txt: No such file or directory", is_error=True),
+            id="failed_observation",
+        ),
+        pytest.param(
+            lambda: AgentErrorEvent(
+                error="Tool 'browser' not found. Available: ['terminal']",
+                tool_name="browser",
+                tool_call_id="call-1",
+            ).to_llm_message(),
+            id="unknown_tool",
+        ),
+        pytest.param(
+            lambda: AgentErrorEvent(
+                error="Error validating args {} for tool 'terminal': command is required",
+                tool_name="terminal",
+                tool_call_id="call-1",
+            ).to_llm_message(),
+            id="invalid_args",
+        ),
+    ])
+    def test_skips_draft_after_failed_tool_call(self, make_tool_error):
+        """A tool error in the previous turn goes straight to the escalation model."""
+        llm = self.cascade(stub_response(tool_call=True))
+        
+        assert llm.completion([user_message("edit a file"), make_tool_error()]) is self.ESCALATED
+        assert llm.draft_llm._calls == 0
+        assert llm.acceptance_rate == pytest.approx(0.9)
+    
+    @pytest.mark.parametrize("output", [
+        pytest.param("a.txt", id="plain"),
+        pytest.param("error.log\na.txt", id="error_file_name"),
+    ])
+    def test_drafts_after_successful_tool_call(self, output):
+        """A successful tool result lets the draft model take the next turn."""
+        draft = stub_response(tool_call=True)
+        llm = self.cascade(draft)
+        
+        assert llm.completion([user_message("list files"), observation_message(output)]) is draft
+        assert llm.escalation_llm._calls == 0
+
+
+class TestResponseCache:
+    """Test the local completion cache."""
+    
+    @pytest.fixture
+    def response_cache_dir(self, tmp_path, monkeypatch):
+        """Enable the response cache in a temporary directory for one test."""
+        monkeypatch.setenv("LLM_CACHE", "1")
+        monkeypatch.setattr("openhands_agent.RESPONSE_CACHE_DIR", str(tmp_path))
+        monkeypatch.setattr(litellm, "cache", None)
+        enable_response_cache.cache_clear()
+        yield tmp_path
+        enable_response_cache.cache_clear()
+    
+    def test_create_llm_keeps_plain_llm(self, response_cache_dir):
+        """Caching goes through LiteLLM, so the SDK still sees a plain LLM."""
+        llm = create_llm(MODELS["gpt-oss"], "test-key")
+        assert type(llm) is LLM
+        assert litellm.cache is not None
+    
+    def test_repeated_completion_served_from_disk(self, response_cache_dir):
+        """A second identical completion through the SDK LLM is replayed from the disk cache."""
+        llm = create_llm(MODELS["gpt-oss"], "test-key")
+        messages = [Message(role="user", content=[TextContent(text="Say hello")])]
+        
+        first = llm.completion(messages, mock_response="Hello!")
+        second = llm.completion(messages, mock_response="Hello!")
+        
+        assert second.raw_response._hidden_params.get("cache_hit") is True
+        assert second.raw_response.id == first.raw_response.id
+        assert _message_text(second.message) == "Hello!"
+        assert any(response_cache_dir.iterdir()), "Expected the cache entry on disk"
+
+
+class TestSemanticCache:
+    """Test the semantic task cache round trip with stub embeddings."""
+    
+    EMBEDDINGS = {
+        "list the files": array("f", [1.0, 0.0]),
+        "show me the files here": array("f", [0.9, 0.436]),
+        "delete the repository": array("f", [0.0, 1.0]),
+    }
+    
+    def test_store_lookup_restore(self, tmp_path, monkeypatch):
+        """A paraphrase with the same LLM config reopens the stored conversation."""
+        conversations_dir = str(tmp_path / "conversations")
+        monkeypatch.setattr("openhands_agent.SEMANTIC_CACHE_DB", str(tmp_path / "semantic.sqlite"))
+        monkeypatch.setattr("openhands_agent.CONVERSATIONS_DIR", conversations_dir)
+        workspace = str(tmp_path / "workspace")
+        os.mkdir(workspace)
+        
+        llm = create_llm(MODELS["gpt-oss"], "test-key")
+        original = Conversation(
+            agent=create_agent(llm),
+            workspace=workspace,
+            persistence_dir=conversations_dir,
+        )
+        llm_config = llm_config_key(llm)
+        listing, paraphrase, unrelated = self.EMBEDDINGS.values()
+        store_cached_task(llm_config, workspace, listing, original.id)
+        
+        assert lookup_cached_task(llm_config, workspace, paraphrase) == original.id
+        assert lookup_cached_task(llm_config, workspace, unrelated) is None
+        assert lookup_cached_task(llm_config, str(tmp_path), listing) is None
+        
+        # A differently configured LLM could not reopen the conversation, so it must miss
+        capped_llm = create_llm(MODELS["gpt-oss"], "test-key", max_output_tokens=256)
+        assert lookup_cached_task(llm_config_key(capped_llm), workspace, listing) is None
+        
+        restored = restore_conversation(
+            create_llm(MODELS["gpt-oss"], "test-key"), workspace, original.id
+        )
+        assert restored.id == original.id
+    
+    def test_pruned_conversation_is_a_miss(self, tmp_path, monkeypatch):
+        """A row whose persisted conversation was deleted is dropped, not restored."""
+        semantic_cache_db = str(tmp_path / "semantic.sqlite")
+        monkeypatch.setattr("openhands_agent.SEMANTIC_CACHE_DB", semantic_cache_db)
+        monkeypatch.setattr("openhands_agent.CONVERSATIONS_DIR", str(tmp_path / "conversations"))
+        listing = self.EMBEDDINGS["list the files"]
+        store_cached_task("config", "workspace", listing, uuid.uuid4())
+        
+        assert lookup_cached_task("config", "workspace", listing) is None
+        with closing(sqlite3.connect(semantic_cache_db)) as db:
+            assert db.execute("SELECT COUNT(*) FROM cached_tasks").fetchone() == (0,)
+
+
+    def test_store_evicts_oldest_conversation(self, tmp_path, monkeypatch):
+        """Past SEMANTIC_CACHE_MAX_ENTRIES, the oldest row and its conversation are removed."""
+        conversations_dir = tmp_path / "conversations"
+        monkeypatch.setattr("openhands_agent.SEMANTIC_CACHE_DB", str(tmp_path / "semantic.sqlite"))
+        monkeypatch.setattr("openhands_agent.CONVERSATIONS_DIR", str(conversations_dir))
+        monkeypatch.setattr("openhands_agent.SEMANTIC_CACHE_MAX_ENTRIES", 1)
+        listing, _, unrelated = self.EMBEDDINGS.values()
+        oldest, newest = uuid.uuid4(), uuid.uuid4()
+        for conversation_id in (oldest, newest):
+            (conversations_dir / conversation_id.hex).mkdir(parents=True)
+        
+        store_cached_task("config", "workspace", listing, oldest)
+        store_cached_task("config", "workspace", unrelated, newest)
+        
+        assert not (conversations_dir / oldest.hex).exists()
+        assert lookup_cached_task("config", "workspace", listing) is None
+        assert lookup_cached_task("config", "workspace", unrelated) == newest
+
+
+class TestLazyTools:
+    """Test lazy tool loading when the SDK resolves tools in parallel."""
+    
+    def test_concurrent_first_use_imports_each_module_once(self, monkeypatch):
+        """Factories racing on first use wait for one complete set of imports."""
+        imported = []
+        
+        class FakeTool:
+            @classmethod
+            def create(cls, conv_state, **params):
+                return [cls]
+        
+        def slow_import(module_name):
+            imported.append(module_name)
+            time.sleep(0.05)  # keep the import window open for the other threads
+            return SimpleNamespace(**{class_name: FakeTool for _, class_name in _LAZY_TOOLS.values()})
+        
+        monkeypatch.setattr("openhands_agent._tool_classes", {})
+        monkeypatch.setattr("openhands_agent.importlib", SimpleNamespace(import_module=slow_import))
+        factories = [_lazy_tool_factory(key) for key in _LAZY_TOOLS] * 4
+        start = threading.Barrier(len(factories))
+        
+        def first_use(factory):
+            start.wait()
+            return factory(conv_state=None)
+        
+        with ThreadPoolExecutor(max_workers=len(factories)) as executor:
+            tools = list(executor.map(first_use, factories))
+        
+        assert tools == [[FakeTool]] * len(factories)
+        assert sorted(imported) == sorted(module for module, _ in _LAZY_TOOLS.values())
 
 
 class TestAgentCreation:
     """Test agent creation with tools."""
     
-    def test_create_agent_with_tools(self, api_key):
+    def test_create_agent_with_tools(self, gpt_oss_llm):
         """Verify agent is created with expected tools."""
-        config = MODELS["gpt-oss"]
-        llm = create_llm(config, api_key)
-        agent = create_agent(llm)
+        agent = create_agent(gpt_oss_llm)
         
         assert agent is not None
         # Agent should have tools configured
@@ -97,6 +467,7 @@ class TestGptOssToolCalling:
     """Integration tests for GPT-OSS-120B tool calling."""
     
     @pytest.mark.integration
+    @pytest.mark.llm_cost("short")
     def test_gpt_oss_file_creation(self, api_key, temp_workspace):
         """
         Test GPT-OSS agent can use tools to create a file.
@@ -112,7 +483,7 @@ class TestGptOssToolCalling:
         conversation = run_gpt_oss_agent(
             task=task,
             workspace=temp_workspace,
-            verbose=False,
+            max_output_tokens=FILE_TASK_MAX_OUTPUT_TOKENS,
         )
         
         # Verify the conversation completed
@@ -125,12 +496,16 @@ class TestGptOssToolCalling:
         # Verify content
         content = output_file.read_text()
         assert "Hello" in content or "GPT" in content, f"Unexpected content: {content}"
+        
+        # The run's LLM is registered for usage stats
+        assert conversation.llm_registry.list_usage_ids()
 
 
 class TestQwenToolCalling:
     """Integration tests for Qwen3 Coder tool calling."""
     
     @pytest.mark.integration
+    @pytest.mark.llm_cost("short")
     def test_qwen_file_creation(self, api_key, temp_workspace):
         """
         Test Qwen agent can use tools to create a file.
@@ -146,7 +521,7 @@ class TestQwenToolCalling:
         conversation = run_qwen_agent(
             task=task,
             workspace=temp_workspace,
-            verbose=False,
+            max_output_tokens=FILE_TASK_MAX_OUTPUT_TOKENS,
         )
         
         # Verify the conversation completed
@@ -161,45 +536,99 @@ class TestQwenToolCalling:
         assert "Hello" in content or "Qwen" in content, f"Unexpected content: {content}"
 
 
+class TestRunners:
+    """Integration tests for the async and cascade runners."""
+    
+    TASK = "Create a file called test_output.txt with the text 'Hello from the runner'"
+    
+    def assert_file_created(self, workspace):
+        output_file = Path(workspace) / "test_output.txt"
+        assert output_file.exists(), f"Expected file not created: {output_file}"
+        assert "Hello" in output_file.read_text()
+    
+    @pytest.mark.integration
+    @pytest.mark.llm_cost("short")
+    def test_run_many(self, api_key, temp_workspace):
+        """run_many drives run_agent_async and returns one conversation per task."""
+        conversations = run_async(run_many([("gpt-oss", self.TASK)], workspace=temp_workspace))
+        
+        assert len(conversations) == 1
+        self.assert_file_created(temp_workspace)
+    
+    @pytest.mark.integration
+    @pytest.mark.llm_cost("short")
+    def test_run_cascade_agent(self, api_key, temp_workspace):
+        """run_cascade_agent completes the task with both sub-LLMs registered."""
+        conversation = run_cascade_agent(self.TASK, workspace=temp_workspace)
+        
+        self.assert_file_created(temp_workspace)
+        usage_ids = set(conversation.llm_registry.list_usage_ids())
+        assert {"cascade-draft", "cascade-escalation"} <= usage_ids
+
+
+DIRECTORY_LISTING_TASK = "List the files in the current directory and save the list to file_list.txt"
+
+
+def run_directory_listing(llm):
+    """Run the directory listing task in a fresh workspace; return (conversation, file_list.txt content)."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Create a test file in the workspace
+        test_file = Path(tmpdir) / "sample.txt"
+        test_file.write_text("Sample content for testing")
+        
+        conversation = run_conversation(
+            llm,
+            task=DIRECTORY_LISTING_TASK,
+            workspace=tmpdir,
+        )
+        
+        output_file = Path(tmpdir) / "file_list.txt"
+        content = output_file.read_text() if output_file.exists() else None
+        return conversation, content
+
+
 class TestBothModels:
     """Comparative tests running both models."""
     
+    @pytest.fixture(scope="class")
+    def directory_listing_result(self, gpt_oss_llm, qwen_llm):
+        """
+        Start the directory listing task for both models at once.
+        
+        The runs are network-bound and use separate workspaces, so they
+        execute concurrently; each parametrized test then waits only for its
+        own model's run. Both runs start even if only one test is selected.
+        """
+        llms = {"gpt-oss": gpt_oss_llm, "qwen": qwen_llm}
+        with ThreadPoolExecutor(max_workers=len(llms)) as executor:
+            runs = {key: executor.submit(run_directory_listing, llm) for key, llm in llms.items()}
+            yield lambda model_key: runs[model_key].result()
+    
     @pytest.mark.integration
-    @pytest.mark.parametrize("model_key,run_fn", [
-        ("gpt-oss", run_gpt_oss_agent),
-        ("qwen", run_qwen_agent),
+    @pytest.mark.llm_cost("long")
+    @pytest.mark.parametrize("model_key", [
+        pytest.param("gpt-oss", id="gpt_oss"),
+        pytest.param("qwen", id="qwen"),
     ])
-    def test_directory_listing_task(self, api_key, temp_workspace, model_key, run_fn):
+    def test_directory_listing_task(self, directory_listing_result, model_key):
         """
         Test both models can complete a directory listing task.
         
         This is a basic validation that tool calling works for both models.
         """
-        # Create a test file in the workspace
-        test_file = Path(temp_workspace) / "sample.txt"
-        test_file.write_text("Sample content for testing")
-        
-        task = "List the files in the current directory and save the list to file_list.txt"
-        
-        conversation = run_fn(
-            task=task,
-            workspace=temp_workspace,
-            verbose=False,
-        )
+        # Re-raises this model's error, if any, without hiding the other model's result
+        conversation, content = directory_listing_result(model_key)
         
         assert conversation is not None
         
         # Check if output file was created
-        output_file = Path(temp_workspace) / "file_list.txt"
-        assert output_file.exists(), f"{model_key}: Expected file_list.txt not created"
+        assert content is not None, f"{model_key}: Expected file_list.txt not created"
         
         # Verify it mentions the sample file
-        content = output_file.read_text()
         assert len(content) > 0, f"{model_key}: file_list.txt is empty"
 
 
 # Convenience functions for running specific test groups
 if __name__ == "__main__":
-    import sys
     pytest.main([__file__, "-v"] + sys.argv[1:])
 
@@ -4,46 +4,105 @@ Test OpenRouter API connection with Qwen3 Coder model.
 
 Uses LiteLLM for OpenRouter routing (same as OpenHands internally).
 See: https://docs.litellm.ai/docs/providers/openrouter
+
+Fires PROBE_COUNT (default 8) concurrent requests through LiteLLM's own
+cached async HTTP client, so connection-pool or proxy throughput regressions
+show up in the reported latency percentiles and tokens/sec.
 """
 
+import asyncio
 import os
+import statistics
+import time
+
 from dotenv import load_dotenv
-from litellm import completion
+from litellm import acompletion
+
+from async_runtime import run_async
 
 # Load environment variables from .env file
 load_dotenv()
 
-def main():
+PROMPT = "Say 'Hello from Qwen3 Coder!' in exactly 5 words."
+
+
+async def probe(model: str) -> dict:
+    """Send one streamed completion and time it."""
+    start = time.perf_counter()
+    response = await acompletion(
+        model=model,
+        messages=[{"role": "user", "content": PROMPT}],
+        max_tokens=50,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    reply = ""
+    first_token_at = None
+    usage = None
+    model_used = model
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            reply += chunk.choices[0].delta.content
+        usage = getattr(chunk, "usage", None) or usage
+        model_used = chunk.model
+    end = time.perf_counter()
+
+    return {
+        "reply": reply,
+        "model": model_used,
+        "latency": end - start,
+        "ttft": (first_token_at or end) - start,
+        "prompt_tokens": usage.prompt_tokens if usage else 0,
+        "completion_tokens": usage.completion_tokens if usage else 0,
+    }
+
+
+def percentile(values: list[float], pct: int) -> float:
+    """Return the pct-th percentile of values."""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+async def main():
     api_key = os.getenv("OPENROUTER_API_KEY")
     # LiteLLM format: openrouter/<model-name>
     model = os.getenv("LLM_MODEL", "openrouter/qwen/qwen3-coder")
-    
+    probe_count = int(os.getenv("PROBE_COUNT", "8"))
+
+    if probe_count < 1:
+        raise ValueError(f"PROBE_COUNT must be at least 1, got {probe_count}")
+
     if not api_key:
         raise ValueError(
             "OPENROUTER_API_KEY not found. "
             "Please set it in your .env file."
         )
-    
+
     # Ensure LiteLLM picks up the API key
     os.environ["OPENROUTER_API_KEY"] = api_key
-    
-    print(f"📡 Testing OpenRouter API via LiteLLM with model: {model}")
-    
-    # LiteLLM handles OpenRouter routing automatically
-    response = completion(
-        model=model,
-        messages=[
-            {"role": "user", "content": "Say 'Hello from Qwen3 Coder!' in exactly 5 words."}
-        ],
-        max_tokens=50,
-    )
-    
-    reply = response.choices[0].message.content
-    print(f"✅ Response: {reply}")
-    print(f"📊 Model used: {response.model}")
-    print(f"🔢 Tokens: {response.usage.prompt_tokens} in, {response.usage.completion_tokens} out")
 
+    print(f"📡 Testing OpenRouter API via LiteLLM with model: {model} ({probe_count} concurrent requests)")
 
-if __name__ == "__main__":
-    main()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(probe(model) for _ in range(probe_count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r["latency"] for r in results]
+    ttfts = [r["ttft"] for r in results]
+    prompt_tokens = sum(r["prompt_tokens"] for r in results)
+    completion_tokens = sum(r["completion_tokens"] for r in results)
 
+    print(f"✅ Response: {results[0]['reply']}")
+    print(f"📊 Model used: {results[0]['model']}")
+    print(f"🔢 Tokens: {prompt_tokens} in, {completion_tokens} out")
+    print(f"⏱️  Latency: p50 {percentile(latencies, 50):.2f}s, p95 {percentile(latencies, 95):.2f}s")
+    print(f"⏱️  Time to first token: p50 {percentile(ttfts, 50):.2f}s, p95 {percentile(ttfts, 95):.2f}s")
+    print(f"🚀 Throughput: {completion_tokens / elapsed:.1f} tokens/s over {elapsed:.2f}s wall")
+
+
+if __name__ == "__main__":
+    run_async(main())